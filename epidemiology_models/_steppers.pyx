@@ -0,0 +1,167 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+""" Compiled Euler and RK4 stepping loops for the models in compartmental_models
+
+    Each function has the same signature as the matching numba kernel in compartmental_models:
+    out - numpy.ndarray(n_sample, n_batch, n_compartments) - out[0] holds the initial conditions
+                                                             of each trajectory; filled on return
+    p - numpy.ndarray(n_batch, n_params) - parameters of each trajectory, ordered as _param_names
+    dt - float - time step in seconds
+
+    The whole loop runs in C without the GIL; only the arrays cross the Python boundary.
+"""
+
+
+cdef inline void _sir_deriv(double S, double I, double R, double beta, double gamma, double N,
+                            double Lambda, double mu, double* d) noexcept nogil:
+    d[0] = (Lambda - mu) * S - beta * I * S / N
+    d[2] = gamma * I - mu * R
+    d[1] = - d[0] - d[2]
+
+
+cdef inline void _seir_deriv(double S, double E, double I, double R, double beta, double gamma,
+                             double N, double lambda_, double mu, double a, double* d) noexcept nogil:
+    d[0] = (lambda_ - mu) * S - beta * I * S / N
+    d[3] = gamma * I - mu * R
+    d[2] = a * E - (gamma + mu) * I
+    d[1] = - d[2] - d[3] - d[0]
+
+
+cdef inline void _sis_deriv(double S, double I, double beta, double gamma, double N,
+                            double* d) noexcept nogil:
+    d[0] = gamma * I - beta * I * S / N
+    d[1] = - d[0]
+
+
+def sir_euler(double[:, :, ::1] out, double[:, ::1] p, double dt):
+    """ forward Euler integration of the SIR model, in place """
+    cdef Py_ssize_t b, i
+    cdef double d[3]
+    cdef double S, I, R
+    with nogil:
+        for b in range(out.shape[1]):
+            S, I, R = out[0, b, 0], out[0, b, 1], out[0, b, 2]
+            for i in range(1, out.shape[0]):
+                _sir_deriv(S, I, R, p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], d)
+                S += d[0] * dt
+                I += d[1] * dt
+                R += d[2] * dt
+                out[i, b, 0] = S
+                out[i, b, 1] = I
+                out[i, b, 2] = R
+
+
+def sir_rk4(double[:, :, ::1] out, double[:, ::1] p, double dt):
+    """ classical Runge-Kutta integration of the SIR model, in place """
+    cdef Py_ssize_t b, i
+    cdef double k1[3]
+    cdef double k2[3]
+    cdef double k3[3]
+    cdef double k4[3]
+    cdef double h = 0.5 * dt
+    cdef double S, I, R
+    with nogil:
+        for b in range(out.shape[1]):
+            S, I, R = out[0, b, 0], out[0, b, 1], out[0, b, 2]
+            for i in range(1, out.shape[0]):
+                _sir_deriv(S, I, R, p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], k1)
+                _sir_deriv(S + h * k1[0], I + h * k1[1], R + h * k1[2],
+                           p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], k2)
+                _sir_deriv(S + h * k2[0], I + h * k2[1], R + h * k2[2],
+                           p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], k3)
+                _sir_deriv(S + dt * k3[0], I + dt * k3[1], R + dt * k3[2],
+                           p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], k4)
+                S += dt * (k1[0] + 2.0 * k2[0] + 2.0 * k3[0] + k4[0]) / 6.0
+                I += dt * (k1[1] + 2.0 * k2[1] + 2.0 * k3[1] + k4[1]) / 6.0
+                R += dt * (k1[2] + 2.0 * k2[2] + 2.0 * k3[2] + k4[2]) / 6.0
+                out[i, b, 0] = S
+                out[i, b, 1] = I
+                out[i, b, 2] = R
+
+
+def seir_euler(double[:, :, ::1] out, double[:, ::1] p, double dt):
+    """ forward Euler integration of the SEIR model, in place """
+    cdef Py_ssize_t b, i
+    cdef double d[4]
+    cdef double S, E, I, R
+    with nogil:
+        for b in range(out.shape[1]):
+            S, E, I, R = out[0, b, 0], out[0, b, 1], out[0, b, 2], out[0, b, 3]
+            for i in range(1, out.shape[0]):
+                _seir_deriv(S, E, I, R, p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], p[b, 5], d)
+                S += d[0] * dt
+                E += d[1] * dt
+                I += d[2] * dt
+                R += d[3] * dt
+                out[i, b, 0] = S
+                out[i, b, 1] = E
+                out[i, b, 2] = I
+                out[i, b, 3] = R
+
+
+def seir_rk4(double[:, :, ::1] out, double[:, ::1] p, double dt):
+    """ classical Runge-Kutta integration of the SEIR model, in place """
+    cdef Py_ssize_t b, i
+    cdef double k1[4]
+    cdef double k2[4]
+    cdef double k3[4]
+    cdef double k4[4]
+    cdef double h = 0.5 * dt
+    cdef double S, E, I, R
+    with nogil:
+        for b in range(out.shape[1]):
+            S, E, I, R = out[0, b, 0], out[0, b, 1], out[0, b, 2], out[0, b, 3]
+            for i in range(1, out.shape[0]):
+                _seir_deriv(S, E, I, R, p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], p[b, 5], k1)
+                _seir_deriv(S + h * k1[0], E + h * k1[1], I + h * k1[2], R + h * k1[3],
+                            p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], p[b, 5], k2)
+                _seir_deriv(S + h * k2[0], E + h * k2[1], I + h * k2[2], R + h * k2[3],
+                            p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], p[b, 5], k3)
+                _seir_deriv(S + dt * k3[0], E + dt * k3[1], I + dt * k3[2], R + dt * k3[3],
+                            p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], p[b, 5], k4)
+                S += dt * (k1[0] + 2.0 * k2[0] + 2.0 * k3[0] + k4[0]) / 6.0
+                E += dt * (k1[1] + 2.0 * k2[1] + 2.0 * k3[1] + k4[1]) / 6.0
+                I += dt * (k1[2] + 2.0 * k2[2] + 2.0 * k3[2] + k4[2]) / 6.0
+                R += dt * (k1[3] + 2.0 * k2[3] + 2.0 * k3[3] + k4[3]) / 6.0
+                out[i, b, 0] = S
+                out[i, b, 1] = E
+                out[i, b, 2] = I
+                out[i, b, 3] = R
+
+
+def sis_euler(double[:, :, ::1] out, double[:, ::1] p, double dt):
+    """ forward Euler integration of the SIS model, in place """
+    cdef Py_ssize_t b, i
+    cdef double d[2]
+    cdef double S, I
+    with nogil:
+        for b in range(out.shape[1]):
+            S, I = out[0, b, 0], out[0, b, 1]
+            for i in range(1, out.shape[0]):
+                _sis_deriv(S, I, p[b, 0], p[b, 1], p[b, 2], d)
+                S += d[0] * dt
+                I += d[1] * dt
+                out[i, b, 0] = S
+                out[i, b, 1] = I
+
+
+def sis_rk4(double[:, :, ::1] out, double[:, ::1] p, double dt):
+    """ classical Runge-Kutta integration of the SIS model, in place """
+    cdef Py_ssize_t b, i
+    cdef double k1[2]
+    cdef double k2[2]
+    cdef double k3[2]
+    cdef double k4[2]
+    cdef double h = 0.5 * dt
+    cdef double S, I
+    with nogil:
+        for b in range(out.shape[1]):
+            S, I = out[0, b, 0], out[0, b, 1]
+            for i in range(1, out.shape[0]):
+                _sis_deriv(S, I, p[b, 0], p[b, 1], p[b, 2], k1)
+                _sis_deriv(S + h * k1[0], I + h * k1[1], p[b, 0], p[b, 1], p[b, 2], k2)
+                _sis_deriv(S + h * k2[0], I + h * k2[1], p[b, 0], p[b, 1], p[b, 2], k3)
+                _sis_deriv(S + dt * k3[0], I + dt * k3[1], p[b, 0], p[b, 1], p[b, 2], k4)
+                S += dt * (k1[0] + 2.0 * k2[0] + 2.0 * k3[0] + k4[0]) / 6.0
+                I += dt * (k1[1] + 2.0 * k2[1] + 2.0 * k3[1] + k4[1]) / 6.0
+                out[i, b, 0] = S
+                out[i, b, 1] = I
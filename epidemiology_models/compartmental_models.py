@@ -1,13 +1,321 @@
+import ast
+import keyword
+import os
+import textwrap
+import types
+import warnings
+import numpy as np
 import pandas as pd
 from datetime import datetime
-from datetime import timedelta
 from datetime import timezone
+from multiprocessing import get_context
+from numba import cuda
+from numba import njit
+from numba import prange
+from numba import threading_layer
+from scipy.integrate import ODEintWarning
+from scipy.integrate import odeint
+from scipy.integrate import solve_ivp
+
+try:
+    from epidemiology_models import _steppers
+except ImportError:  # compiled steppers not built, see setup.py
+    _steppers = None
+
+
+_STEP_METHODS = ('euler', 'rk4')
+_SCIPY_METHODS = ('LSODA', 'RK45', 'RK23', 'DOP853', 'Radau', 'BDF')
+_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+
+
+@njit(fastmath=True, cache=True)
+def _sir_deriv(S, I, R, beta, gamma, N, Lambda, mu):
+    """ returns time derivative of the SIR model, (dS, dI, dR) """
+    dS = (Lambda - mu) * S - beta * I * S / N
+    dR = gamma * I - mu * R
+    dI = - dS - dR
+    return dS, dI, dR
+
+
+@njit(fastmath=True, cache=True)
+def _sir_euler_trajectory(out, p, b, dt):
+    """ forward Euler integration of one trajectory of the SIR model, in place
+
+        out - numpy.ndarray(n_sample, n_batch, 3) - out[0] holds the initial (S, I, R) of each
+                                                    trajectory; out[:, b] filled on return
+        p - numpy.ndarray(n_batch, 5) - (beta, gamma, N, Lambda, mu) of each trajectory
+        b - int - index of the trajectory to integrate
+        dt - float - time step in seconds
+    """
+    beta, gamma, N, Lambda, mu = p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4]
+    S, I, R = out[0, b, 0], out[0, b, 1], out[0, b, 2]
+    for i in range(1, out.shape[0]):
+        dS, dI, dR = _sir_deriv(S, I, R, beta, gamma, N, Lambda, mu)
+        S += dS * dt
+        I += dI * dt
+        # R is a pure sink when mu == 0, but stepping only (S, I) here and recovering R with a
+        # cumsum afterwards measured ~2.5x slower than this one fused update
+        R += dR * dt
+        out[i, b, 0] = S
+        out[i, b, 1] = I
+        out[i, b, 2] = R
+
+
+@njit(fastmath=True, cache=True)
+def _sir_rk4_trajectory(out, p, b, dt):
+    """ classical Runge-Kutta integration of one trajectory of the SIR model, in place;
+        arguments as _sir_euler_trajectory
+    """
+    beta, gamma, N, Lambda, mu = p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4]
+    h = 0.5 * dt
+    S, I, R = out[0, b, 0], out[0, b, 1], out[0, b, 2]
+    for i in range(1, out.shape[0]):
+        k1S, k1I, k1R = _sir_deriv(S, I, R, beta, gamma, N, Lambda, mu)
+        k2S, k2I, k2R = _sir_deriv(S + h * k1S, I + h * k1I, R + h * k1R, beta, gamma, N, Lambda, mu)
+        k3S, k3I, k3R = _sir_deriv(S + h * k2S, I + h * k2I, R + h * k2R, beta, gamma, N, Lambda, mu)
+        k4S, k4I, k4R = _sir_deriv(S + dt * k3S, I + dt * k3I, R + dt * k3R, beta, gamma, N, Lambda, mu)
+        S += dt * (k1S + 2.0 * k2S + 2.0 * k3S + k4S) / 6.0
+        I += dt * (k1I + 2.0 * k2I + 2.0 * k3I + k4I) / 6.0
+        R += dt * (k1R + 2.0 * k2R + 2.0 * k3R + k4R) / 6.0
+        out[i, b, 0] = S
+        out[i, b, 1] = I
+        out[i, b, 2] = R
+
+
+@njit(fastmath=True, cache=True, parallel=True)
+def _sir_euler(out, p, dt):
+    """ forward Euler integration of every trajectory of the SIR model, in parallel, in place;
+        out, p and dt as _sir_euler_trajectory
+    """
+    for b in prange(out.shape[1]):
+        _sir_euler_trajectory(out, p, b, dt)
+
+
+@njit(fastmath=True, cache=True, parallel=True)
+def _sir_rk4(out, p, dt):
+    """ classical Runge-Kutta integration of every trajectory of the SIR model, in parallel, in place;
+        out, p and dt as _sir_euler_trajectory
+    """
+    for b in prange(out.shape[1]):
+        _sir_rk4_trajectory(out, p, b, dt)
+
+
+@njit(fastmath=True, cache=True)
+def _seir_deriv(S, E, I, R, beta, gamma, N, lambda_, mu, a):
+    """ returns time derivative of the SEIR model, (dS, dE, dI, dR) """
+    dS = (lambda_ - mu) * S - beta * I * S / N
+    dR = gamma * I - mu * R
+    dI = a * E - (gamma + mu) * I
+    dE = - dI - dR - dS
+    return dS, dE, dI, dR
+
+
+@njit(fastmath=True, cache=True)
+def _seir_euler_trajectory(out, p, b, dt):
+    """ forward Euler integration of one trajectory of the SEIR model, in place
+
+        out - numpy.ndarray(n_sample, n_batch, 4) - out[0] holds the initial (S, E, I, R) of each
+                                                    trajectory; out[:, b] filled on return
+        p - numpy.ndarray(n_batch, 6) - (beta, gamma, N, lambda, mu, a) of each trajectory
+        b - int - index of the trajectory to integrate
+        dt - float - time step in seconds
+    """
+    beta, gamma, N, lambda_, mu, a = p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], p[b, 5]
+    S, E, I, R = out[0, b, 0], out[0, b, 1], out[0, b, 2], out[0, b, 3]
+    for i in range(1, out.shape[0]):
+        dS, dE, dI, dR = _seir_deriv(S, E, I, R, beta, gamma, N, lambda_, mu, a)
+        S += dS * dt
+        E += dE * dt
+        I += dI * dt
+        R += dR * dt
+        out[i, b, 0] = S
+        out[i, b, 1] = E
+        out[i, b, 2] = I
+        out[i, b, 3] = R
+
+
+@njit(fastmath=True, cache=True)
+def _seir_rk4_trajectory(out, p, b, dt):
+    """ classical Runge-Kutta integration of one trajectory of the SEIR model, in place;
+        arguments as _seir_euler_trajectory
+    """
+    beta, gamma, N, lambda_, mu, a = p[b, 0], p[b, 1], p[b, 2], p[b, 3], p[b, 4], p[b, 5]
+    h = 0.5 * dt
+    S, E, I, R = out[0, b, 0], out[0, b, 1], out[0, b, 2], out[0, b, 3]
+    for i in range(1, out.shape[0]):
+        k1S, k1E, k1I, k1R = _seir_deriv(S, E, I, R, beta, gamma, N, lambda_, mu, a)
+        k2S, k2E, k2I, k2R = _seir_deriv(S + h * k1S, E + h * k1E, I + h * k1I, R + h * k1R,
+                                         beta, gamma, N, lambda_, mu, a)
+        k3S, k3E, k3I, k3R = _seir_deriv(S + h * k2S, E + h * k2E, I + h * k2I, R + h * k2R,
+                                         beta, gamma, N, lambda_, mu, a)
+        k4S, k4E, k4I, k4R = _seir_deriv(S + dt * k3S, E + dt * k3E, I + dt * k3I, R + dt * k3R,
+                                         beta, gamma, N, lambda_, mu, a)
+        S += dt * (k1S + 2.0 * k2S + 2.0 * k3S + k4S) / 6.0
+        E += dt * (k1E + 2.0 * k2E + 2.0 * k3E + k4E) / 6.0
+        I += dt * (k1I + 2.0 * k2I + 2.0 * k3I + k4I) / 6.0
+        R += dt * (k1R + 2.0 * k2R + 2.0 * k3R + k4R) / 6.0
+        out[i, b, 0] = S
+        out[i, b, 1] = E
+        out[i, b, 2] = I
+        out[i, b, 3] = R
+
+
+@njit(fastmath=True, cache=True, parallel=True)
+def _seir_euler(out, p, dt):
+    """ forward Euler integration of every trajectory of the SEIR model, in parallel, in place;
+        out, p and dt as _seir_euler_trajectory
+    """
+    for b in prange(out.shape[1]):
+        _seir_euler_trajectory(out, p, b, dt)
+
+
+@njit(fastmath=True, cache=True, parallel=True)
+def _seir_rk4(out, p, dt):
+    """ classical Runge-Kutta integration of every trajectory of the SEIR model, in parallel, in place;
+        out, p and dt as _seir_euler_trajectory
+    """
+    for b in prange(out.shape[1]):
+        _seir_rk4_trajectory(out, p, b, dt)
+
+
+@njit(fastmath=True, cache=True)
+def _sis_deriv(S, I, beta, gamma, N):
+    """ returns time derivative of the SIS model, (dS, dI) """
+    dS = gamma * I - beta * I * S / N
+    dI = - dS
+    return dS, dI
+
+
+@njit(fastmath=True, cache=True)
+def _sis_euler_trajectory(out, p, b, dt):
+    """ forward Euler integration of one trajectory of the SIS model, in place
+
+        out - numpy.ndarray(n_sample, n_batch, 2) - out[0] holds the initial (S, I) of each
+                                                    trajectory; out[:, b] filled on return
+        p - numpy.ndarray(n_batch, 3) - (beta, gamma, N) of each trajectory
+        b - int - index of the trajectory to integrate
+        dt - float - time step in seconds
+    """
+    beta, gamma, N = p[b, 0], p[b, 1], p[b, 2]
+    S, I = out[0, b, 0], out[0, b, 1]
+    for i in range(1, out.shape[0]):
+        dS, dI = _sis_deriv(S, I, beta, gamma, N)
+        S += dS * dt
+        I += dI * dt
+        out[i, b, 0] = S
+        out[i, b, 1] = I
+
+
+@njit(fastmath=True, cache=True)
+def _sis_rk4_trajectory(out, p, b, dt):
+    """ classical Runge-Kutta integration of one trajectory of the SIS model, in place;
+        arguments as _sis_euler_trajectory
+    """
+    beta, gamma, N = p[b, 0], p[b, 1], p[b, 2]
+    h = 0.5 * dt
+    S, I = out[0, b, 0], out[0, b, 1]
+    for i in range(1, out.shape[0]):
+        k1S, k1I = _sis_deriv(S, I, beta, gamma, N)
+        k2S, k2I = _sis_deriv(S + h * k1S, I + h * k1I, beta, gamma, N)
+        k3S, k3I = _sis_deriv(S + h * k2S, I + h * k2I, beta, gamma, N)
+        k4S, k4I = _sis_deriv(S + dt * k3S, I + dt * k3I, beta, gamma, N)
+        S += dt * (k1S + 2.0 * k2S + 2.0 * k3S + k4S) / 6.0
+        I += dt * (k1I + 2.0 * k2I + 2.0 * k3I + k4I) / 6.0
+        out[i, b, 0] = S
+        out[i, b, 1] = I
+
+
+@njit(fastmath=True, cache=True, parallel=True)
+def _sis_euler(out, p, dt):
+    """ forward Euler integration of every trajectory of the SIS model, in parallel, in place;
+        out, p and dt as _sis_euler_trajectory
+    """
+    for b in prange(out.shape[1]):
+        _sis_euler_trajectory(out, p, b, dt)
+
+
+@njit(fastmath=True, cache=True, parallel=True)
+def _sis_rk4(out, p, dt):
+    """ classical Runge-Kutta integration of every trajectory of the SIS model, in parallel, in place;
+        out, p and dt as _sis_euler_trajectory
+    """
+    for b in prange(out.shape[1]):
+        _sis_rk4_trajectory(out, p, b, dt)
+
+
+class _InlineParams(ast.NodeTransformer):
+    """ replaces references to model parameters with their values as literal constants """
+
+    def __init__(self, values):
+        self._values = values
+
+    def visit_Name(self, node):
+        if node.id in self._values:
+            return ast.copy_location(ast.Constant(self._values[node.id]), node)
+        return node
+
+
+def _compile_rhs(template, compartments, param_names, param_values):
+    """ generate and compile rhs(t, y) for a model from its equations, with every parameter
+        inlined as a literal so that the function does no name lookups for them
+
+        template - str - python statements assigning d<compartment> for every compartment, in terms
+                         of the compartments and parameters (python keywords get a trailing '_')
+        compartments - tuple<str> - compartment names, in state order
+        param_names - tuple<str> - parameter names
+        param_values - tuple<float> - parameter values, ordered as param_names
+
+        returns function rhs(t, y) -> numpy.ndarray
+    """
+    src = (f"def rhs(t, y):\n"
+           f"    {', '.join(compartments)}, = y\n"
+           f"{textwrap.indent(textwrap.dedent(template).strip(), '    ')}\n"
+           f"    return np.array([{', '.join('d' + c for c in compartments)}])\n")
+    values = {(k + '_' if keyword.iskeyword(k) else k): v for k, v in zip(param_names, param_values)}
+    tree = ast.fix_missing_locations(_InlineParams(values).visit(ast.parse(src)))
+    namespace = {'np': np}
+    exec(compile(tree, '<generated rhs>', 'exec'), namespace)
+    return namespace['rhs']
+
+
+_cuda_kernels = {}
+
+
+def _cuda_integrate(trajectory, out, p, dt, threads_per_block=128):
+    """ integrate every trajectory on the GPU, one CUDA thread per trajectory, in place
+
+        trajectory - numba dispatcher - one of the *_trajectory functions above; its python source
+                                        is compiled unchanged as a CUDA device function
+        out, p, dt - as the *_trajectory functions
+        threads_per_block - int - CUDA block size
+    """
+    if trajectory not in _cuda_kernels:
+        device_trajectory = cuda.jit(device=True)(trajectory.py_func)
+
+        @cuda.jit
+        def kernel(out, p, dt):
+            b = cuda.grid(1)
+            if b < out.shape[1]:
+                device_trajectory(out, p, b, dt)
+        _cuda_kernels[trajectory] = kernel
+    d_out = cuda.to_device(out)
+    n_blocks = (out.shape[1] + threads_per_block - 1) // threads_per_block
+    _cuda_kernels[trajectory][n_blocks, threads_per_block](d_out, cuda.to_device(p), dt)
+    d_out.copy_to_host(out)
 
 
 class BaseModel:
     """ Generic base model to implement numerical integration of epidemiology models as reported on
         https://en.wikipedia.org/wiki/Compartmental_models_in_epidemiology
     """
+    _compartments = ()
+    _param_names = ()
+    _param_defaults = {}
+    _kernels = {}
+    _trajectories = {}
+    _c_kernels = {}
+    _jac = None
+    _rhs_template = None
 
     def __init__(self, params, initial_conditions):
         """ params - dict<str, float> - parameters for model
@@ -16,35 +324,236 @@ class BaseModel:
         self._params = params
         self._initial_conditions = initial_conditions
 
-    def _deriv(self, p, c):
-        """ p - dict<str, float> - parameters for model
-            c - dict<str, float> - current state of model
+    @property
+    def _params(self):
+        """ read-only view of the model's own copy of its parameters """
+        return types.MappingProxyType(self._raw_params)
 
-            returns time derivative, dict<str, float>
+    @_params.setter
+    def _params(self, params):
+        """ resolve the parameters, and drop anything specialised to the old ones, on every assignment;
+            a private copy is kept, so the caller's dict can be reused without affecting the model
+            (a plain dict, unlike a mappingproxy, keeps the model picklable)
+        """
+        self._raw_params = dict(params)
+        self._param_values = self._resolve_params()
+        self._rhs = None
+
+    def __getstate__(self):
+        """ the rhs generated by build_rhs cannot be pickled; it is left out and rebuilt on demand """
+        state = self.__dict__.copy()
+        state['_rhs'] = None
+        return state
+
+    def _deriv(self, p, c, out=None):
+        """ p - tuple<float> - parameters for model, ordered as _param_names
+            c - numpy.ndarray - current state of model, ordered as _compartments
+            out - numpy.ndarray - optional buffer to write the time derivative into
+
+            returns time derivative, numpy.ndarray, ordered as _compartments
         """
         raise NotImplementedError
 
-    def get_numerical_results(self, n_sample, dt_secs, init_time=None):
+    def build_rhs(self):
+        """ returns rhs(t, y), the time derivative of the model with its parameters bound once,
+            in the form expected by scipy.integrate and similar integrators
+            t - float - time in seconds
+            y - numpy.ndarray - current state of model, ordered as _compartments
+
+            models with an _rhs_template get rhs generated with the parameter values inlined
+        """
+        if self._rhs is None:
+            if self._rhs_template is not None:
+                self._rhs = _compile_rhs(self._rhs_template, self._compartments,
+                                         self._param_names, self._param_values)
+            else:
+                deriv = self._deriv
+                p = self._param_values
+
+                def rhs(t, y):
+                    return deriv(p, y)
+                self._rhs = rhs
+        return self._rhs
+
+    def _resolve_params(self):
+        """ returns model parameters as a tuple of floats, ordered as _param_names,
+            with _param_defaults filled in for missing optional parameters
+        """
+        p = self._params
+        return tuple(float(p[k] if k in p else self._param_defaults[k]) for k in self._param_names)
+
+    def _integrate_deriv(self, out, dt_secs, method):
+        """ integrate through _deriv, in place, for models without compiled kernels
+
+            out - numpy.ndarray(n_sample, n_compartments) - out[0] holds the initial conditions;
+                                                            filled on return
+            dt_secs - float - time step in seconds
+            method - str - 'euler' or 'rk4'
+        """
+        p = self._param_values
+        # the only copy: x is a running state updated in place and stored with out[i] = x each step;
+        # stepping as np.add(out[i-1], k, out=out[i]) instead allocates two views per step and is no faster
+        x = out[0].copy()
+        k1, k2, k3, k4, tmp = np.empty((5, len(x)), dtype=out.dtype)
+        for i_sample in range(1, out.shape[0]):
+            self._deriv(p, x, out=k1)
+            if method == 'euler':
+                k1 *= dt_secs
+            else:
+                np.multiply(k1, 0.5 * dt_secs, out=tmp)
+                tmp += x
+                self._deriv(p, tmp, out=k2)
+                np.multiply(k2, 0.5 * dt_secs, out=tmp)
+                tmp += x
+                self._deriv(p, tmp, out=k3)
+                np.multiply(k3, dt_secs, out=tmp)
+                tmp += x
+                self._deriv(p, tmp, out=k4)
+                k2 += k3
+                k2 *= 2.0
+                k1 += k2
+                k1 += k4
+                k1 *= dt_secs / 6.0
+            x += k1
+            out[i_sample] = x
+
+    def _integrate_scipy(self, out, dt_secs, method):
+        """ integrate with an adaptive scipy solver, in place, sampling onto the fixed time grid;
+            the analytic _jac, when the model has one, is supplied to the implicit solvers
+
+            out - numpy.ndarray(n_sample, n_compartments) - out[0] holds the initial conditions;
+                                                            filled on return
+            dt_secs - float - time step in seconds
+            method - str - 'LSODA' (via scipy.integrate.odeint) or a scipy.integrate.solve_ivp method
+        """
+        if out.shape[0] == 1:
+            return
+        t = np.arange(out.shape[0]) * dt_secs
+        rhs = self.build_rhs()
+        if method == 'LSODA':
+            with warnings.catch_warnings():
+                # a failed solve is raised below rather than warned about
+                warnings.simplefilter('ignore', ODEintWarning)
+                y, info = odeint(rhs, out[0], t, Dfun=self._jac, tfirst=True, full_output=True)
+            if info['message'] != 'Integration successful.':
+                raise RuntimeError(info['message'])
+            out[:] = y
+        else:
+            options = {'jac': self._jac} if method in ('Radau', 'BDF') else {}
+            sol = solve_ivp(rhs, (t[0], t[-1]), out[0], method=method, t_eval=t,
+                            rtol=1.0e-8, atol=1.0e-6, **options)
+            if not sol.success:
+                raise RuntimeError(sol.message)
+            out[:] = sol.y.T
+
+    def get_numerical_results(self, n_sample, dt_secs, init_time=None, method='euler', dtype=np.float64):
         """ n_sample - int - number of samples to generate
             dt_secs - float - time step in seconds
             init_time - datetime.datetime - initial timestamp of sample zero
+            method - str - integration scheme; 'euler' (forward Euler), 'rk4' (classical Runge-Kutta),
+                           'LSODA' (scipy.integrate.odeint) or any other scipy.integrate.solve_ivp
+                           method, e.g. 'RK45', 'BDF'
+            dtype - numpy.dtype - numpy.float32 or numpy.float64; 'euler' and 'rk4' integrate at
+                                  this precision as well as store the results in it, while the
+                                  scipy methods integrate in float64 and only store in it.
+                                  numpy.float32 halves the memory of long runs at the cost of
+                                  ~7 significant digits
 
             returns dataframe
         """
-        result_list = []
-        x = self._initial_conditions.copy()
-        result_list.append(x.copy())
-        for i_sample in range(1, n_sample):
-            deriv = self._deriv(self._params, x)
-            x = {k: (v + deriv[k] * dt_secs) for k, v in x.items()}
-            result_list.append(x.copy())
+        if method not in _STEP_METHODS + _SCIPY_METHODS:
+            raise ValueError(f"unknown integration method '{method}'")
+        dtype = np.dtype(dtype)
+        if dtype not in _DTYPES:
+            raise ValueError(f"unsupported dtype '{dtype}', expected float32 or float64")
+        x = np.array([self._initial_conditions[k] for k in self._compartments], dtype=dtype)
+        c_kernel = self._c_kernels.get(method) if dtype == np.float64 else None
+        trajectory = self._trajectories.get(method)
+        if method in _SCIPY_METHODS:
+            out = np.empty((n_sample, len(self._compartments)), dtype=dtype)
+            out[0] = x
+            self._integrate_scipy(out, dt_secs, method)
+        elif c_kernel is not None or trajectory is not None:
+            batch = np.empty((n_sample, 1, len(self._compartments)), dtype=dtype)
+            batch[0, 0] = x
+            p = np.array([self._param_values], dtype=dtype)
+            if trajectory is not None:
+                # a single trajectory steps serially; the prange kernels in _kernels are kept for
+                # get_numerical_results_batch, so a single run never starts numba's thread pool.
+                # The fastmath numba trajectories measured ~2x faster than the compiled steppers
+                # (1M SIR Euler steps: 6.7 ms vs 13.1 ms), so those are only a fallback
+                trajectory(batch, p, 0, dtype.type(dt_secs))
+            else:
+                c_kernel(batch, p, dtype.type(dt_secs))
+            out = batch[:, 0]
+        else:
+            out = np.empty((n_sample, len(self._compartments)), dtype=dtype)
+            out[0] = x
+            self._integrate_deriv(out, dt_secs, method)
+        return self._results_frame(out, dt_secs, init_time)
+
+    def _results_frame(self, out, dt_secs, init_time=None):
+        """ out - numpy.ndarray(n_sample, n_compartments) - trajectory, columns ordered as _compartments
+            dt_secs - float - time step in seconds
+            init_time - datetime.datetime - initial timestamp of sample zero
+
+            returns pandas.DataFrame with one column per compartment and a 'timestamp' column
+        """
         if init_time is None:
             init_time = datetime.fromtimestamp(0, tz=timezone.utc)
-        df = pd.DataFrame(result_list)
-        df['timestamp'] = [init_time + timedelta(seconds=x*dt_secs)
-                           for x in range(n_sample)]
-        df.set_index('timestamp')
-        return df
+        # out is a fresh array of a single run that nothing else references once this returns, so the
+        # frame can adopt its columns as views instead of copying; each column views a disjoint slice
+        columns = {name: out[:, i] for i, name in enumerate(self._compartments)}
+        columns['timestamp'] = pd.date_range(start=init_time, periods=len(out),
+                                             freq=pd.Timedelta(seconds=dt_secs))
+        return pd.DataFrame(columns, copy=False)
+
+    @classmethod
+    def get_numerical_results_batch(cls, params_array, init_array, n_sample, dt_secs, method='euler',
+                                    target='cpu', dtype=np.float64):
+        """ integrate many independent trajectories of the model at once, e.g. for parameter sweeps
+
+            params_array - array-like(n_batch, n_params) - parameters of each trajectory,
+                                                          columns ordered as _param_names
+            init_array - array-like(n_batch, n_compartments) - initial condition of each trajectory,
+                                                               columns ordered as _compartments
+            n_sample - int - number of samples to generate
+            dt_secs - float - time step in seconds
+            method - str - integration scheme; 'euler' (forward Euler) or 'rk4' (classical Runge-Kutta)
+            target - str - 'cpu' (parallel over CPU cores) or 'cuda' (one GPU thread per trajectory)
+            dtype - numpy.dtype - numpy.float32 or numpy.float64; the integration runs at this
+                                  precision, not only the storage of the results
+
+            returns numpy.ndarray(n_sample, n_batch, n_compartments)
+        """
+        if method not in _STEP_METHODS:
+            raise ValueError(f"unknown integration method '{method}'")
+        if target not in ('cpu', 'cuda'):
+            raise ValueError(f"unknown target '{target}'")
+        if target == 'cuda' and method not in cls._trajectories:
+            raise NotImplementedError(f"{cls.__name__} has no CUDA '{method}' integration")
+        dtype = np.dtype(dtype)
+        if dtype not in _DTYPES:
+            raise ValueError(f"unsupported dtype '{dtype}', expected float32 or float64")
+        params_array = np.ascontiguousarray(params_array, dtype=dtype)
+        init_array = np.asarray(init_array, dtype=dtype)
+        n_batch = len(params_array)
+        if (params_array.shape != (n_batch, len(cls._param_names)) or
+                init_array.shape != (n_batch, len(cls._compartments))):
+            raise ValueError(f"expected params_array of shape {(n_batch, len(cls._param_names))} and "
+                             f"init_array of shape {(n_batch, len(cls._compartments))}")
+        out = np.empty((n_sample, n_batch, len(cls._compartments)), dtype=dtype)
+        out[0] = init_array
+        kernel = cls._kernels.get(method)
+        if target == 'cuda':
+            _cuda_integrate(cls._trajectories[method], out, params_array, dtype.type(dt_secs))
+        elif kernel is not None:
+            kernel(out, params_array, dtype.type(dt_secs))
+        else:
+            for b, (p, x) in enumerate(zip(params_array, init_array)):
+                m = cls(dict(zip(cls._param_names, p)), dict(zip(cls._compartments, x)))
+                m._integrate_deriv(out[:, b], dt_secs, method)
+        return out
 
     def get_R0(self):
         """ return the basic reproduction number of the model """
@@ -74,24 +583,87 @@ class SIRModel(BaseModel):
 
         R0 = beta/gamma
     """
+    _compartments = ('S', 'I', 'R')
+    _param_names = ('beta', 'gamma', 'N', 'Lambda', 'mu')
+    _param_defaults = {'Lambda': 0.0, 'mu': 0.0}
+    _kernels = {'euler': _sir_euler, 'rk4': _sir_rk4}
+    _rhs_template = """
+        dS = (Lambda - mu) * S - beta * I * S / N
+        dR = gamma * I - mu * R
+        dI = - dS - dR
+    """
+    _trajectories = {'euler': _sir_euler_trajectory, 'rk4': _sir_rk4_trajectory}
+    _c_kernels = {'euler': _steppers.sir_euler, 'rk4': _steppers.sir_rk4} if _steppers else {}
 
-    def _deriv(self, p, c):
-        """ p - dict<str, float> - parameters for model
-                                   keys = {'beta', 'gamma', 'N'}
-                                   optional keys = {'Lambda', 'mu'}
-            c - dict<str, float> - current state of model
-                                   keys = {'S', 'I', 'R'}
+    def _deriv(self, p, c, out=None):
+        """ p - tuple<float> - parameters for model
+                                 order = ('beta', 'gamma', 'N', 'Lambda', 'mu')
+            c - numpy.ndarray - current state of model
+                                order = ('S', 'I', 'R')
+            out - numpy.ndarray - optional buffer to write the time derivative into
 
-            returns time derivative, dict<str, float>, keys = {'S', 'I', 'R'}
+            returns time derivative, numpy.ndarray, order = ('S', 'I', 'R')
+        """
+        beta, gamma, N, Lambda, mu = p
+        S, I, R = c
+        dS = (Lambda - mu) * S - beta * I * S / N
+        dR = gamma * I - mu * R
+        dI = - dS - dR
+        if out is None:
+            out = np.empty(3)
+        out[0] = dS
+        out[1] = dI
+        out[2] = dR
+        return out
+
+    def _jac(self, t, y):
+        """ t - float - time in seconds
+            y - numpy.ndarray - current state of model, order = ('S', 'I', 'R')
+
+            returns Jacobian of the time derivative, numpy.ndarray(3, 3)
         """
-        p = p.copy()  # leave calling ref unchanged
-        p['Lambda'] = p.get('Lambda', 0.0)
-        p['mu'] = p.get('mu', 0.0)
-        deriv = {}
-        deriv['S'] = (p['Lambda'] - p['mu']) * c['S'] - p['beta'] * c['I'] * c['S'] / p['N']
-        deriv['R'] = p['gamma'] * c['I'] - p['mu'] * c['R']
-        deriv['I'] = - deriv['S'] - deriv['R']
-        return deriv
+        beta, gamma, N, Lambda, mu = self._param_values
+        S, I, R = y
+        dS = (Lambda - mu - beta * I / N, -beta * S / N, 0.0)
+        dR = (0.0, gamma, -mu)
+        dI = tuple(- ds - dr for ds, dr in zip(dS, dR))
+        return np.array([dS, dI, dR])
+
+    def get_final_size(self, tol=1e-12, max_iter=100):
+        """ number of susceptible left once the epidemic has died out, without time stepping
+
+            tol - float - relative tolerance on the final susceptible fraction
+            max_iter - int - maximum number of Newton iterations
+
+            Kermack-McKendrick: with no births or deaths (Lambda = mu = 0), dS/dR = -R0*S/N and the
+            total M = S0 + I0 + R_init is conserved, so S_inf = S0*exp(-R0*(M - S_inf - R_init)/N).
+            M need not equal N. The root in [0, S0] is found by Newton's
+            method from 0; the residual is concave and increasing there, so the iterates increase
+            monotonically to the root. With no infected at the start there is no epidemic, and
+            S_inf = S0.
+
+            returns S_inf, float
+        """
+        beta, gamma, N, Lambda, mu = self._param_values
+        if Lambda != 0.0 or mu != 0.0:
+            raise ValueError('final size is only defined for Lambda = mu = 0')
+        if gamma == 0.0:
+            raise ValueError('final size is only defined for gamma > 0')
+        x0 = self._initial_conditions
+        if x0['I'] == 0:
+            return float(x0['S'])
+        R0 = beta / gamma
+        s0 = x0['S'] / N
+        r_init = x0['R'] / N
+        m = (x0['S'] + x0['I'] + x0['R']) / N
+        s = 0.0
+        for _ in range(max_iter):
+            e = s0 * np.exp(-R0 * (m - s - r_init))
+            step = (s - e) / (1.0 - R0 * e)
+            s -= step
+            if abs(step) <= tol * max(s, tol):
+                return s * N
+        raise RuntimeError(f'final size did not converge in {max_iter} iterations')
 
     def get_R0(self):
         """ return the basic reproduction number of the model """
@@ -122,21 +694,54 @@ class SEIRModel(BaseModel):
 
         R0 = (a/(mu+a))*(beta/(mu+gamma))
     """
+    _compartments = ('S', 'E', 'I', 'R')
+    _param_names = ('beta', 'gamma', 'N', 'lambda', 'mu', 'a')
+    _kernels = {'euler': _seir_euler, 'rk4': _seir_rk4}
+    _rhs_template = """
+        dS = (lambda_ - mu) * S - beta * I * S / N
+        dR = gamma * I - mu * R
+        dI = a * E - (gamma + mu) * I
+        dE = - dI - dR - dS
+    """
+    _trajectories = {'euler': _seir_euler_trajectory, 'rk4': _seir_rk4_trajectory}
+    _c_kernels = {'euler': _steppers.seir_euler, 'rk4': _steppers.seir_rk4} if _steppers else {}
 
-    def _deriv(self, p, c):
-        """ p - dict<str, float> - parameters for model
-                                   keys = {'beta', 'gamma', 'N', 'mu', 'lambda', 'a'}
-            c - dict<str, float> - current state of model
-                                   keys = {'S', 'I', 'E', 'R'}
+    def _deriv(self, p, c, out=None):
+        """ p - tuple<float> - parameters for model
+                                 order = ('beta', 'gamma', 'N', 'lambda', 'mu', 'a')
+            c - numpy.ndarray - current state of model
+                                order = ('S', 'E', 'I', 'R')
+            out - numpy.ndarray - optional buffer to write the time derivative into
 
-            returns time derivative, dict<str, float>, keys = {'S', 'I', 'E', 'R'}
+            returns time derivative, numpy.ndarray, order = ('S', 'E', 'I', 'R')
+        """
+        beta, gamma, N, lambda_, mu, a = p
+        S, E, I, R = c
+        dS = (lambda_ - mu) * S - beta * I * S / N
+        dR = gamma * I - mu * R
+        dI = a * E - (gamma + mu)*I
+        dE = - dI - dR - dS
+        if out is None:
+            out = np.empty(4)
+        out[0] = dS
+        out[1] = dE
+        out[2] = dI
+        out[3] = dR
+        return out
+
+    def _jac(self, t, y):
+        """ t - float - time in seconds
+            y - numpy.ndarray - current state of model, order = ('S', 'E', 'I', 'R')
+
+            returns Jacobian of the time derivative, numpy.ndarray(4, 4)
         """
-        deriv = {}
-        deriv['S'] = (p['lambda'] - p['mu']) * c['S'] - p['beta'] * c['I'] * c['S'] / p['N']
-        deriv['R'] = p['gamma'] * c['I'] - p['mu'] * c['R']
-        deriv['I'] = p['a'] * c['E'] - (p['gamma'] + p['mu'])*c['I']
-        deriv['E'] = - deriv['I'] - deriv['R'] - deriv['S']
-        return deriv
+        beta, gamma, N, lambda_, mu, a = self._param_values
+        S, E, I, R = y
+        dS = (lambda_ - mu - beta * I / N, 0.0, -beta * S / N, 0.0)
+        dR = (0.0, 0.0, gamma, -mu)
+        dI = (0.0, a, -(gamma + mu), 0.0)
+        dE = tuple(- di - dr - ds for di, dr, ds in zip(dI, dR, dS))
+        return np.array([dS, dE, dI, dR])
 
     def get_R0(self):
         """ return the basic reproduction number of the model """
@@ -162,21 +767,130 @@ class SISModel(BaseModel):
 
         R0 = beta/gamma
     """
+    _compartments = ('S', 'I')
+    _param_names = ('beta', 'gamma', 'N')
+    _kernels = {'euler': _sis_euler, 'rk4': _sis_rk4}
+    _rhs_template = """
+        dS = gamma * I - beta * I * S / N
+        dI = - dS
+    """
+    _trajectories = {'euler': _sis_euler_trajectory, 'rk4': _sis_rk4_trajectory}
+    _c_kernels = {'euler': _steppers.sis_euler, 'rk4': _steppers.sis_rk4} if _steppers else {}
 
-    def _deriv(self, p, c):
-        """ p - dict<str, float> - parameters for model
-                                   keys = {'beta', 'gamma', 'N'}
-            c - dict<str, float> - current state of model
-                                   keys = {'S', 'I', 'R'}
+    def _deriv(self, p, c, out=None):
+        """ p - tuple<float> - parameters for model
+                                 order = ('beta', 'gamma', 'N')
+            c - numpy.ndarray - current state of model
+                                order = ('S', 'I')
+            out - numpy.ndarray - optional buffer to write the time derivative into
 
-            returns time derivative, dict<str, float>, keys = {'S', 'I', 'R'}
+            returns time derivative, numpy.ndarray, order = ('S', 'I')
+        """
+        beta, gamma, N = p
+        S, I = c
+        dS = gamma * I - beta * I * S / N
+        dI = - dS
+        if out is None:
+            out = np.empty(2)
+        out[0] = dS
+        out[1] = dI
+        return out
+
+    def _jac(self, t, y):
+        """ t - float - time in seconds
+            y - numpy.ndarray - current state of model, order = ('S', 'I')
+
+            returns Jacobian of the time derivative, numpy.ndarray(2, 2)
         """
-        deriv = {}
-        deriv['S'] = p['gamma'] * c['I'] - p['beta'] * c['I'] * c['S'] / p['N']
-        deriv['I'] = - deriv['S']
-        return deriv
+        beta, gamma, N = self._param_values
+        S, I = y
+        dS = (-beta * I / N, gamma - beta * S / N)
+        dI = tuple(- ds for ds in dS)
+        return np.array([dS, dI])
+
+    def get_numerical_results_analytic(self, n_sample, dt_secs, init_time=None):
+        """ evaluate the closed-form (logistic) solution of the model on the same time grid
+            as get_numerical_results; no time stepping is done
+
+            n_sample - int - number of samples to generate
+            dt_secs - float - time step in seconds
+            init_time - datetime.datetime - initial timestamp of sample zero
+
+            with the conserved total M = S0 + I0 (which need not equal N), r = beta*M/N - gamma and
+            K = M - gamma*N/beta, the infected follow I(t) = K / (1 + ((K - I0)/I0)*exp(-r*t)),
+            and S = M - I; for beta = 0 this reduces to I(t) = I0*exp(-gamma*t)
+
+            The result is exact up to floating point rounding, with a relative error of a few ulp
+            at any t. Euler and RK4 only converge to it as dt_secs -> 0, with errors O(dt) and
+            O(dt^4) respectively.
+
+            returns pandas.DataFrame, as get_numerical_results
+        """
+        beta, gamma, N = self._param_values
+        I0 = float(self._initial_conditions['I'])
+        M = float(self._initial_conditions['S']) + I0
+        t = np.arange(n_sample) * float(dt_secs)
+        r = beta * M / N - gamma
+        if I0 == 0.0:
+            I = np.zeros(n_sample)
+        elif beta == 0.0:
+            # no contacts, only recovery
+            I = I0 * np.exp(-gamma * t)
+        elif r == 0.0:
+            # limit of the logistic as K -> 0
+            I = I0 / (1.0 + beta * I0 * t / N)
+        else:
+            K = N * r / beta
+            with np.errstate(over='ignore'):
+                I = K / (1.0 + ((K - I0) / I0) * np.exp(-r * t))
+        out = np.empty((n_sample, 2))
+        out[:, 0] = M - I
+        out[:, 1] = I
+        return self._results_frame(out, dt_secs, init_time)
 
     def get_R0(self):
         """ return the basic reproduction number of the model """
         p = self._params
         return p['beta']/p['gamma']
+
+
+def _run_sweep_one(args):
+    """ worker for run_sweep; returns the dataframe of a single model run """
+    model_cls, params, initial_conditions, n_sample, dt_secs, method = args
+    return model_cls(params, initial_conditions).get_numerical_results(n_sample, dt_secs, method=method)
+
+
+def run_sweep(model_cls, params_list, init_list, n_sample, dt_secs, method='euler', nproc=None):
+    """ run one model over many parameter sets in a pool of worker processes
+
+        model_cls - class - BaseModel subclass to run, e.g. SIRModel
+        params_list - list<dict<str, float>> - parameters for each run
+        init_list - list<dict<str, float>> - initial conditions for each run
+        n_sample - int - number of samples to generate
+        dt_secs - float - time step in seconds
+        method - str - integration scheme, as for BaseModel.get_numerical_results
+        nproc - int - number of worker processes; defaults to os.cpu_count(), and is capped at
+                      the number of runs
+
+        The pool uses the platform's default start method. Each run steps serially (see
+        get_numerical_results), so forked workers never touch numba's thread pool. If this process
+        has already started that pool (e.g. via get_numerical_results_batch), forking it can hang at
+        exit, so spawn is used instead. Under spawn (always on Windows and macOS) the workers
+        re-import the calling script, so a script calling run_sweep must do so under an
+        if __name__ == '__main__': guard.
+
+        returns list<dataframe>, one per run, in the order of params_list
+    """
+    if len(params_list) != len(init_list):
+        raise ValueError("params_list and init_list must have the same length")
+    args = [(model_cls, p, x, n_sample, dt_secs, method) for p, x in zip(params_list, init_list)]
+    if not args:
+        return []
+    nproc = min(nproc or os.cpu_count(), len(args))
+    try:
+        threading_layer()
+        context = get_context('spawn')
+    except ValueError:  # numba's thread pool not started in this process
+        context = get_context()
+    with context.Pool(nproc) as pool:
+        return list(pool.imap(_run_sweep_one, args, chunksize=max(1, len(args) // (4 * nproc))))
@@ -0,0 +1,25 @@
+""" Builds the optional compiled steppers in epidemiology_models/_steppers.pyx
+
+    pip install .                         (build requirements are declared in pyproject.toml)
+    python setup.py build_ext --inplace   (for working in the source tree)
+
+    The extension is optional: the build is skipped with a warning when no C compiler is available.
+    compartmental_models steps with its numba kernels first, and only uses the compiled steppers
+    for a model without a numba kernel for the requested method.
+"""
+from Cython.Build import cythonize
+from setuptools import Extension
+from setuptools import setup
+
+
+extensions = cythonize([Extension('epidemiology_models._steppers', ['epidemiology_models/_steppers.pyx'])])
+for extension in extensions:
+    # cythonize does not carry optional over to the extensions it returns
+    extension.optional = True
+
+setup(
+    name='epidemiology_models',
+    packages=['epidemiology_models'],
+    install_requires=['numba>=0.49.0', 'numpy>=1.18.1', 'pandas>=1.0.3', 'scipy>=1.4.1'],
+    ext_modules=extensions,
+)
@@ -2,7 +2,19 @@ from epidemiology_models.compartmental_models import SIRModel
 from epidemiology_models.compartmental_models import SISModel
 from epidemiology_models.compartmental_models import SEIRModel
 from epidemiology_models.compartmental_models import BaseModel
+from epidemiology_models.compartmental_models import run_sweep
+import copy
+import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
+import textwrap
+import numpy as np
 from pytest import approx
+from pytest import importorskip
+from pytest import mark
+from numba import cuda
 from pytest import raises
 from datetime import datetime
 from datetime import timezone
@@ -17,6 +29,73 @@ def test_BaseModel():
         m.get_R0()
 
 
+def test_BaseModel_params():
+    # the model keeps a read-only copy of its parameters
+    N = 1.0e7
+    params = {'beta': 0.0002, 'gamma': 0.0001, 'N': N}
+    m = SISModel(params, {'S': N-1, 'I': 1})
+    params['beta'] = 0.0005
+    assert m._params['beta'] == 0.0002
+    assert m._param_values == (0.0002, 0.0001, N)
+    with raises(TypeError):
+        m._params['beta'] = 0.0005
+
+
+def test_BaseModel_pickle():
+    N = 1.0e7
+    m = SISModel({'beta': 0.0002, 'gamma': 0.0001, 'N': N}, {'S': N-1, 'I': 1})
+    expected = m.get_numerical_results(100, 3600)
+    for m2 in (pickle.loads(pickle.dumps(m)), copy.deepcopy(m)):
+        assert dict(m2._params) == dict(m._params)
+        assert m2._param_values == m._param_values
+        assert list(m2.get_numerical_results(100, 3600)['I']) == list(expected['I'])
+    # a model that has generated its rhs for a scipy run still pickles, and rebuilds the rhs
+    expected = m.get_numerical_results(100, 3600, method='LSODA')
+    for m2 in (pickle.loads(pickle.dumps(m)), copy.deepcopy(m)):
+        assert list(m2.get_numerical_results(100, 3600, method='LSODA')['I']) == list(expected['I'])
+
+
+def test_build_rhs():
+    # reassigning the parameters re-specializes the generated rhs
+    N = 1.0e7
+    m = SISModel({'beta': 0.0002, 'gamma': 0.0001, 'N': N}, {'S': N-1, 'I': 1})
+    y = np.array([6.0e6, 4.0e6])
+    assert list(m.build_rhs()(0.0, y)) == approx(list(m._deriv(m._param_values, y)))
+    m._params = {'beta': 0.0003, 'gamma': 0.0001, 'N': N}
+    assert m._param_values == (0.0003, 0.0001, N)
+    assert list(m.build_rhs()(0.0, y)) == approx([-0.0003 * 4.0e6 * 6.0e6 / N + 0.0001 * 4.0e6,
+                                                  0.0003 * 4.0e6 * 6.0e6 / N - 0.0001 * 4.0e6])
+
+
+class DecayModel(BaseModel):
+    """ model without a compiled kernel, integrated through _deriv """
+    _compartments = ('I',)
+    _param_names = ('gamma',)
+
+    def _deriv(self, p, c, out=None):
+        return np.multiply(c, -p[0], out=out)
+
+
+def test_BaseModel_deriv_fallback():
+    t0 = datetime.fromtimestamp(0, tz=timezone.utc)
+    m = DecayModel({'gamma': 0.5}, {'I': 8.0})
+    df = m.get_numerical_results(4, 1.0)
+    assert set(df.columns) == {'I', 'timestamp'}
+    assert list(df['I']) == [approx(8.0), approx(4.0), approx(2.0), approx(1.0)]
+    assert df['timestamp'].iloc[-1] == t0+timedelta(seconds=3)
+
+    # one RK4 step multiplies by the 4th order Taylor expansion of exp(-0.5)
+    df = m.get_numerical_results(2, 1.0, method='rk4')
+    assert list(df['I']) == [approx(8.0), approx(8.0 * (1 - 0.5 + 0.5**2/2 - 0.5**3/6 + 0.5**4/24))]
+    with raises(ValueError):
+        m.get_numerical_results(2, 1.0, method='midpoint')
+
+    out = DecayModel.get_numerical_results_batch([[0.5], [0.25]], [[8.0], [4.0]], 3, 1.0)
+    assert out.shape == (3, 2, 1)
+    assert list(out[:, 0, 0]) == [approx(8.0), approx(4.0), approx(2.0)]
+    assert list(out[:, 1, 0]) == [approx(4.0), approx(3.0), approx(2.25)]
+
+
 def test_SIRModel():
     t0 = datetime.fromtimestamp(0, tz=timezone.utc)
     N = 1.0e7
@@ -33,6 +112,18 @@ def test_SIRModel():
                                                                approx(1814351.5805256944),
                                                                t0+timedelta(seconds=99*3600)]
 
+    # final size agrees with a long adaptive run once the epidemic has died out
+    df = m.get_numerical_results(2000, 36000, method='LSODA')
+    assert m.get_final_size() == approx(df['S'].iloc[-1], rel=1e-6)
+    # S0 + I0 + R0 != N
+    m2 = SIRModel(params, {'S': N/2, 'I': 100, 'R': N/10})
+    df = m2.get_numerical_results(2000, 36000, method='LSODA')
+    assert m2.get_final_size() == approx(df['S'].iloc[-1], rel=1e-6)
+    # no infected, no epidemic
+    assert SIRModel(params, {'S': N, 'I': 0, 'R': 0}).get_final_size() == N
+    with raises(ValueError):
+        SIRModel({'beta': 0.0002, 'gamma': 0.0, 'N': N}, x0).get_final_size()
+
     params = {'beta': 0.0002, 'gamma': 0.0001, 'N': N, 'Lambda': 0.00001, 'mu': 0.00001}
     m = SIRModel(params, x0)
     df = m.get_numerical_results(100, 3600)
@@ -45,6 +136,103 @@ def test_SIRModel():
                                                                approx(61187.063907258365),
                                                                t0+timedelta(seconds=99*3600)]
 
+    with raises(ValueError):
+        m.get_final_size()
+
+    rhs = m.build_rhs()
+    y = np.array([6.0e6, 3.0e6, 1.0e6])
+    assert list(rhs(0.0, y)) == approx(list(m._deriv(m._param_values, y)))
+
+    # RK4 at a coarse step stays close to a ten times finer step, where Euler is ~20% off in S
+    df = m.get_numerical_results(100, 3600, method='rk4')
+    df_fine = m.get_numerical_results(991, 360, method='rk4')
+    assert len(df) == 100
+    assert list(df[['I', 'R', 'S']].iloc[-1]) == approx(list(df_fine[['I', 'R', 'S']].iloc[-1]), rel=1e-3)
+    assert df['timestamp'].iloc[-1] == df_fine['timestamp'].iloc[-1]
+
+    # single precision storage stays close to the double precision result
+    df32 = m.get_numerical_results(100, 3600, method='rk4', dtype=np.float32)
+    assert set(df32[['I', 'R', 'S']].dtypes) == {np.dtype(np.float32)}
+    assert list(df32[['I', 'R', 'S']].iloc[-1]) == approx(list(df[['I', 'R', 'S']].iloc[-1]), rel=1e-4)
+    for dtype in (np.float16, np.int64):
+        with raises(ValueError):
+            m.get_numerical_results(100, 3600, dtype=dtype)
+
+    # adaptive scipy solvers, sampled onto the same grid, agree with the fine RK4 solution
+    for method in ('LSODA', 'BDF', 'RK45'):
+        df = m.get_numerical_results(100, 3600, method=method)
+        assert len(df) == 100
+        assert list(df[['I', 'R', 'S']].iloc[0]) == [approx(1.0), approx(0.0), approx(N-1.0)]
+        assert list(df[['I', 'R', 'S']].iloc[-1]) == approx(list(df_fine[['I', 'R', 'S']].iloc[-1]), rel=1e-5)
+        # a single sample is just the initial conditions
+        df = m.get_numerical_results(1, 3600, method=method)
+        assert list(df[['I', 'R', 'S']].iloc[0]) == [approx(1.0), approx(0.0), approx(N-1.0)]
+
+    # a failed solve raises instead of returning a zeroed trajectory
+    stiff = SIRModel({'beta': 2.0e4, 'gamma': 0.0001, 'N': N}, x0)
+    with raises(RuntimeError):
+        stiff.get_numerical_results(5, 3.6e9, method='LSODA')
+
+
+def test_SIRModel_batch():
+    N = 1.0e7
+    params = [{'beta': 0.0002, 'gamma': 0.0001, 'N': N},
+              {'beta': 0.0002, 'gamma': 0.0001, 'N': N, 'Lambda': 0.00001, 'mu': 0.00001},
+              {'beta': 0.0003, 'gamma': 0.0001, 'N': N / 2, 'Lambda': 0.0, 'mu': 0.0}]
+    inits = [{'S': N-1, 'I': 1, 'R': 0},
+             {'S': N-1, 'I': 1, 'R': 0},
+             {'S': N/2-10, 'I': 10, 'R': 0}]
+    params_array = [SIRModel(p, x)._param_values for p, x in zip(params, inits)]
+    init_array = [[x['S'], x['I'], x['R']] for x in inits]
+    for method in ('euler', 'rk4'):
+        out = SIRModel.get_numerical_results_batch(params_array, init_array, 100, 3600, method=method)
+        assert out.shape == (100, 3, 3)
+        for b, (p, x) in enumerate(zip(params, inits)):
+            df = SIRModel(p, x).get_numerical_results(100, 3600, method=method)
+            assert out[:, b, :] == approx(df[['S', 'I', 'R']].to_numpy())
+        out32 = SIRModel.get_numerical_results_batch(params_array, init_array, 100, 3600, method=method,
+                                                     dtype=np.float32)
+        assert out32.dtype == np.float32
+        assert out32 == approx(out, rel=1e-4)
+    with raises(ValueError):
+        SIRModel.get_numerical_results_batch(params_array, init_array[:2], 100, 3600)
+    with raises(ValueError):
+        SIRModel.get_numerical_results_batch(params_array, init_array, 100, 3600, dtype=np.float16)
+    with raises(ValueError):
+        SIRModel.get_numerical_results_batch(params_array, init_array, 100, 3600, target='tpu')
+
+
+@mark.skipif(not cuda.is_available(), reason='no CUDA device')
+def test_batch_cuda():
+    N = 1.0e7
+    cases = [(SIRModel, [[0.0002, 0.0001, N, 0.00001, 0.00001]] * 300, [[N-1, 1, 0]] * 300),
+             (SEIRModel, [[0.0002, 0.0001, N, 0.0, 0.0, 0.00005]] * 300, [[N-1, 0, 1, 0]] * 300),
+             (SISModel, [[0.0002, 0.0001, N]] * 300, [[N-1, 1]] * 300)]
+    for cls, params_array, init_array in cases:
+        for method in ('euler', 'rk4'):
+            out = cls.get_numerical_results_batch(params_array, init_array, 100, 3600, method=method,
+                                                  target='cuda')
+            expected = cls.get_numerical_results_batch(params_array, init_array, 100, 3600, method=method)
+            assert out == approx(expected)
+
+
+def test_compiled_steppers():
+    steppers = importorskip('epidemiology_models._steppers')
+    N = 1.0e7
+    cases = [(SIRModel, steppers.sir_euler, steppers.sir_rk4,
+              [0.0002, 0.0001, N, 0.00001, 0.00001], [N-1, 1, 0]),
+             (SEIRModel, steppers.seir_euler, steppers.seir_rk4,
+              [0.0002, 0.0001, N, 0.0, 0.0, 0.00005], [N-1, 0, 1, 0]),
+             (SISModel, steppers.sis_euler, steppers.sis_rk4,
+              [0.0002, 0.0001, N], [N-1, 1])]
+    for cls, euler, rk4, p, x0 in cases:
+        for method, stepper in (('euler', euler), ('rk4', rk4)):
+            out = np.empty((200, 1, len(x0)))
+            out[0, 0] = x0
+            stepper(out, np.array([p]), 3600.0)
+            expected = cls.get_numerical_results_batch([p], [x0], 200, 3600, method=method)
+            assert out == approx(expected)
+
 
 def test_SEIRModel():
     t0 = datetime.fromtimestamp(0, tz=timezone.utc)
@@ -67,6 +255,35 @@ def test_SEIRModel():
                                                                     approx(435.5348557787078),
                                                                     t0+timedelta(seconds=9999*3600)]
 
+    # implicit solver with the analytic Jacobian agrees with a ten times finer RK4 run
+    df = m.get_numerical_results(1000, 3600, method='LSODA')
+    df_fine = m.get_numerical_results(9991, 360, method='rk4')
+    assert list(df[['S', 'E', 'I', 'R']].iloc[-1]) == approx(list(df_fine[['S', 'E', 'I', 'R']].iloc[-1]),
+                                                             rel=1e-5)
+
+
+@mark.parametrize('m, y', [
+    (SIRModel({'beta': 0.0002, 'gamma': 0.0001, 'N': 1.0e7, 'Lambda': 0.00003, 'mu': 0.00001},
+              {'S': 0, 'I': 0, 'R': 0}),
+     [6.0e6, 3.0e6, 1.0e6]),
+    (SEIRModel({'beta': 0.0002, 'gamma': 0.0001, 'N': 1.0e7, 'lambda': 0.00003, 'mu': 0.00001, 'a': 0.00005},
+               {'S': 0, 'E': 0, 'I': 0, 'R': 0}),
+     [5.0e6, 2.0e6, 2.0e6, 1.0e6]),
+    (SISModel({'beta': 0.0002, 'gamma': 0.0001, 'N': 1.0e7}, {'S': 0, 'I': 0}),
+     [6.0e6, 4.0e6]),
+])
+def test_jacobian(m, y):
+    # analytic Jacobian against central differences of the generated rhs
+    rhs = m.build_rhs()
+    y = np.array(y)
+    h = 1.0
+    fd = np.empty((len(y), len(y)))
+    for j in range(len(y)):
+        dy = np.zeros(len(y))
+        dy[j] = h
+        fd[:, j] = (rhs(0.0, y + dy) - rhs(0.0, y - dy)) / (2 * h)
+    assert m._jac(0.0, y) == approx(fd, rel=1e-6, abs=1e-12)
+
 
 def test_SISModel():
     t0 = datetime.fromtimestamp(0, tz=timezone.utc)
@@ -82,3 +299,62 @@ def test_SISModel():
     assert list(df[['I', 'S', 'timestamp']].iloc[-1]) == [approx(4999999.9981355285),
                                                           approx(5000000.001864466),
                                                           t0+timedelta(seconds=99*3600)]
+
+    t1 = datetime(2020, 3, 1, tzinfo=timezone.utc)
+    df = m.get_numerical_results(3, 1800, init_time=t1)
+    assert list(df['timestamp']) == [t1, t1+timedelta(seconds=1800), t1+timedelta(seconds=3600)]
+
+    # closed-form logistic matches a fine RK4 run on the same time grid
+    df = m.get_numerical_results_analytic(100, 3600)
+    assert list(df.columns) == ['S', 'I', 'timestamp']
+    assert list(df[['I', 'S', 'timestamp']].iloc[0]) == [approx(1.0), approx(N-1.0), t0]
+    fine = m.get_numerical_results(100*60, 60, method='rk4')
+    assert list(df['I']) == approx(list(fine['I'][::60]), rel=1e-8)
+    assert list(df['S'] + df['I']) == approx([N]*100)
+    assert list(df['timestamp']) == list(fine['timestamp'][::60])
+    for method in ('LSODA', 'BDF'):
+        df_scipy = m.get_numerical_results(100, 3600, method=method)
+        assert list(df_scipy['I']) == approx(list(df['I']), rel=1e-5)
+    df = SISModel({'beta': 0.0001, 'gamma': 0.0001, 'N': N}, x0).get_numerical_results_analytic(3, 3600)
+    assert list(df['I']) == approx([1.0, 1.0/(1.0 + 0.0001*3600/N), 1.0/(1.0 + 0.0001*7200/N)])
+    df = SISModel({'beta': 0.0, 'gamma': 0.0001, 'N': N}, x0).get_numerical_results_analytic(3, 3600)
+    assert list(df['I']) == approx([1.0, np.exp(-0.36), np.exp(-0.72)])
+    # S0 + I0 != N: the conserved total is S0 + I0, not N
+    for x in ({'S': N/2, 'I': 10}, {'S': N/4, 'I': 1000}, {'S': 2*N, 'I': 1}):
+        m2 = SISModel(params, x)
+        df = m2.get_numerical_results_analytic(100, 3600)
+        fine = m2.get_numerical_results(100*60, 60, method='rk4')
+        assert list(df['I']) == approx(list(fine['I'][::60]), rel=1e-6)
+        assert list(df['S']) == approx(list(fine['S'][::60]), rel=1e-6)
+
+
+def test_run_sweep():
+    N = 1.0e7
+    params_list = [{'beta': beta, 'gamma': 0.0001, 'N': N} for beta in (0.00015, 0.0002, 0.0003)]
+    init_list = [{'S': N-1, 'I': 1}] * 3
+    dfs = run_sweep(SISModel, params_list, init_list, 100, 3600, nproc=2)
+    assert len(dfs) == 3
+    for df, p, x in zip(dfs, params_list, init_list):
+        expected = SISModel(p, x).get_numerical_results(100, 3600)
+        assert list(df['I']) == approx(list(expected['I']))
+        assert list(df['timestamp']) == list(expected['timestamp'])
+    with raises(ValueError):
+        run_sweep(SISModel, params_list, init_list[:2], 100, 3600)
+    assert run_sweep(SISModel, [], [], 100, 3600) == []
+
+
+@mark.skipif(multiprocessing.get_start_method() != 'fork', reason='default start method is not fork')
+def test_run_sweep_unguarded_script(tmp_path):
+    # a plain script without an if __name__ == '__main__': guard must not hang
+    script = tmp_path / 'sweep.py'
+    script.write_text(textwrap.dedent("""
+        from epidemiology_models.compartmental_models import SISModel, run_sweep
+        N = 1.0e7
+        dfs = run_sweep(SISModel, [{'beta': 0.0002, 'gamma': 0.0001, 'N': N}] * 4,
+                        [{'S': N-1, 'I': 1}] * 4, 100, 3600, nproc=8)
+        print(len(dfs))
+    """))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=120, env=env)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '4'